@@ -0,0 +1,552 @@
+"""
+Read-side queries for the dashboard over filtered_data and log_raw_to_filt.
+
+Every function expects a cursor created with ``row_factory=dict_row`` and a
+database where ``ensure_pipeline_tables`` has already run (via the transfer or
+``migrations.py``), since cache checks read ``filtered_data_generation``.
+"""
+
+from __future__ import annotations
+
+import logging
+import math
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Hashable, List, Optional, Sequence, Tuple
+
+import psycopg
+from psycopg import sql
+
+from pipeline_common import BATCH_COMPLETED_MESSAGE
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_POINTS = 1_000
+# LTTB runs over min/max points from this many SQL buckets per requested point.
+LTTB_PREBUCKET_FACTOR = 10
+DEFAULT_CACHE_SIZE = 256
+DEFAULT_CACHE_TTL_SECONDS = 30.0
+# Fitbit reports confidence on a 0-3 scale; the dashboard schema expects 0.0-1.0.
+MAX_CONFIDENCE = 3
+
+CacheKey = Tuple[str, Optional[str], Tuple[Hashable, ...]]
+
+
+class TTLCache:
+    """
+    Thread-safe LRU cache whose entries also expire after ``ttl_seconds``.
+
+    Each entry remembers the version token it was computed under (a
+    ``filtered_data_generation`` value, or the latest log id for health); a
+    lookup with a different token is a miss, so results go stale as soon as the
+    underlying rows change instead of waiting for the TTL.
+    """
+
+    def __init__(
+        self,
+        maxsize: int = DEFAULT_CACHE_SIZE,
+        ttl_seconds: float = DEFAULT_CACHE_TTL_SECONDS,
+    ) -> None:
+        self.maxsize = maxsize
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[CacheKey, Tuple[float, int, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    def get(self, key: CacheKey, generation: int) -> Tuple[bool, Any]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return False, None
+            expires_at, cached_generation, value = entry
+            if expires_at <= now or cached_generation != generation:
+                del self._entries[key]
+                return False, None
+            self._entries.move_to_end(key)
+            return True, value
+
+    def set(self, key: CacheKey, generation: int, value: Any) -> None:
+        expires_at = time.monotonic() + self.ttl_seconds
+        with self._lock:
+            self._entries[key] = (expires_at, generation, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+RESULT_CACHE = TTLCache()
+
+
+def _current_generation(cur: psycopg.Cursor, person_id: Optional[str]) -> int:
+    """Read the transfer's generation for ``person_id``, or the sum across all persons."""
+    if person_id is None:
+        cur.execute(
+            "SELECT COALESCE(SUM(generation), 0) AS generation FROM filtered_data_generation"
+        )
+    else:
+        cur.execute(
+            "SELECT generation FROM filtered_data_generation WHERE person_id = %s",
+            (person_id,),
+        )
+    row = cur.fetchone()
+    return int(row["generation"]) if row and row.get("generation") is not None else 0
+
+
+def _latest_log_id(cur: psycopg.Cursor) -> int:
+    cur.execute("SELECT MAX(id) AS latest FROM log_raw_to_filt")
+    row = cur.fetchone()
+    return int(row["latest"]) if row and row.get("latest") is not None else 0
+
+
+def _cached(
+    cur: psycopg.Cursor,
+    name: str,
+    person_id: Optional[str],
+    args: Tuple[Hashable, ...],
+    loader: Callable[[], Any],
+    *,
+    version: Optional[Callable[[], int]] = None,
+) -> Any:
+    key: CacheKey = (name, person_id, args)
+    generation = version() if version else _current_generation(cur, person_id)
+    hit, value = RESULT_CACHE.get(key, generation)
+    if hit:
+        logger.debug("Cache hit for %s person=%s args=%s", name, person_id, args)
+        return value
+    value = loader()
+    RESULT_CACHE.set(key, generation, value)
+    return value
+
+
+def get_person_series(
+    cur: psycopg.Cursor,
+    person_id: str,
+    start: datetime,
+    end: datetime,
+    *,
+    max_points: int = DEFAULT_MAX_POINTS,
+    method: str = "minmax",
+) -> Dict[str, Any]:
+    """
+    Return heart rate samples for ``person_id`` in ``[start, end)``.
+
+    Ranges with more than ``max_points`` samples are downsampled in the
+    database into min/max/avg buckets (``method="minmax"``) or with
+    Largest-Triangle-Three-Buckets (``method="lttb"``). LTTB runs in Python over
+    the min and max samples of ``LTTB_PREBUCKET_FACTOR * max_points`` SQL
+    buckets, so long ranges never ship every row to Python.
+    """
+    if method not in ("minmax", "lttb"):
+        raise ValueError(f"Unknown downsampling method: {method}")
+    if max_points < 3:
+        raise ValueError("max_points must be at least 3")
+
+    return _cached(
+        cur,
+        "person_series",
+        person_id,
+        (start, end, max_points, method),
+        lambda: _load_person_series(cur, person_id, start, end, max_points, method),
+    )
+
+
+def _load_person_series(
+    cur: psycopg.Cursor,
+    person_id: str,
+    start: datetime,
+    end: datetime,
+    max_points: int,
+    method: str,
+) -> Dict[str, Any]:
+    cur.execute(
+        """
+        SELECT COUNT(*) AS cnt
+        FROM filtered_data
+        WHERE person_id = %s AND date_time >= %s AND date_time < %s
+        """,
+        (person_id, start, end),
+    )
+    row = cur.fetchone()
+    sample_count = int(row["cnt"]) if row and row.get("cnt") is not None else 0
+    logger.debug(
+        "Series for %s between %s and %s has %s samples.",
+        person_id,
+        start,
+        end,
+        sample_count,
+    )
+
+    result: Dict[str, Any] = {
+        "person_id": person_id,
+        "window": {"start": start, "end": end},
+        "sample_count": sample_count,
+        "downsampled": False,
+        "method": None,
+        "points": [],
+    }
+
+    if sample_count <= max_points:
+        result["points"] = _fetch_raw_points(cur, person_id, start, end)
+        return result
+
+    result["downsampled"] = True
+    result["method"] = method
+    if method == "lttb":
+        prebuckets = max_points * LTTB_PREBUCKET_FACTOR
+        if sample_count > 2 * prebuckets:
+            candidates = _fetch_prebucketed_points(cur, person_id, start, end, prebuckets)
+        else:
+            candidates = _fetch_raw_points(cur, person_id, start, end)
+        result["points"] = _lttb(candidates, max_points)
+        return result
+
+    bucket_seconds = max(math.ceil((end - start).total_seconds() / max_points), 1)
+    result["bucket_seconds"] = bucket_seconds
+    cur.execute(
+        """
+        SELECT
+            %(start)s::timestamp + make_interval(
+                secs => floor(extract(epoch FROM date_time - %(start)s::timestamp) / %(width)s) * %(width)s
+            ) AS bucket_start,
+            MIN(bpm) AS min_bpm,
+            MAX(bpm) AS max_bpm,
+            AVG(bpm)::float AS avg_bpm,
+            COUNT(*) AS sample_count
+        FROM filtered_data
+        WHERE person_id = %(person_id)s
+          AND date_time >= %(start)s
+          AND date_time < %(end)s
+        GROUP BY bucket_start
+        ORDER BY bucket_start
+        """,
+        {"person_id": person_id, "start": start, "end": end, "width": bucket_seconds},
+    )
+    result["points"] = [dict(row) for row in cur.fetchall()]
+    return result
+
+
+def _fetch_raw_points(
+    cur: psycopg.Cursor, person_id: str, start: datetime, end: datetime
+) -> List[Dict[str, Any]]:
+    cur.execute(
+        """
+        SELECT date_time, bpm, confidence
+        FROM filtered_data
+        WHERE person_id = %s AND date_time >= %s AND date_time < %s
+        ORDER BY date_time
+        """,
+        (person_id, start, end),
+    )
+    return [dict(row) for row in cur.fetchall()]
+
+
+def _fetch_prebucketed_points(
+    cur: psycopg.Cursor, person_id: str, start: datetime, end: datetime, buckets: int
+) -> List[Dict[str, Any]]:
+    """Return the lowest and highest bpm sample of each of ``buckets`` equal time buckets."""
+    bucket_seconds = max((end - start).total_seconds() / buckets, 1.0)
+    cur.execute(
+        """
+        SELECT date_time, bpm, confidence
+        FROM (
+            SELECT
+                date_time,
+                bpm,
+                confidence,
+                row_number() OVER (PARTITION BY bucket ORDER BY bpm, date_time) AS low_rank,
+                row_number() OVER (PARTITION BY bucket ORDER BY bpm DESC, date_time) AS high_rank
+            FROM (
+                SELECT
+                    date_time,
+                    bpm,
+                    confidence,
+                    floor(extract(epoch FROM date_time - %(start)s::timestamp) / %(width)s) AS bucket
+                FROM filtered_data
+                WHERE person_id = %(person_id)s
+                  AND date_time >= %(start)s
+                  AND date_time < %(end)s
+            ) bucketed
+        ) ranked
+        WHERE low_rank = 1 OR high_rank = 1
+        ORDER BY date_time
+        """,
+        {"person_id": person_id, "start": start, "end": end, "width": bucket_seconds},
+    )
+    return [dict(row) for row in cur.fetchall()]
+
+
+def _lttb(points: Sequence[Dict[str, Any]], threshold: int) -> List[Dict[str, Any]]:
+    """Largest-Triangle-Three-Buckets downsampling of ordered ``date_time``/``bpm`` points."""
+    if threshold >= len(points) or threshold < 3:
+        return list(points)
+
+    xs = [point["date_time"].timestamp() for point in points]
+    ys = [float(point["bpm"]) for point in points]
+
+    sampled = [points[0]]
+    bucket_width = (len(points) - 2) / (threshold - 2)
+    selected = 0
+
+    for bucket in range(threshold - 2):
+        bucket_start = int(bucket * bucket_width) + 1
+        bucket_end = int((bucket + 1) * bucket_width) + 1
+
+        next_start = bucket_end
+        next_end = min(int((bucket + 2) * bucket_width) + 1, len(points))
+        span = max(next_end - next_start, 1)
+        avg_x = sum(xs[next_start:next_end]) / span
+        avg_y = sum(ys[next_start:next_end]) / span
+
+        ax, ay = xs[selected], ys[selected]
+        best_area = -1.0
+        best_index = bucket_start
+        for index in range(bucket_start, bucket_end):
+            area = abs((ax - avg_x) * (ys[index] - ay) - (ax - xs[index]) * (avg_y - ay))
+            if area > best_area:
+                best_area = area
+                best_index = index
+
+        sampled.append(points[best_index])
+        selected = best_index
+
+    sampled.append(points[-1])
+    return sampled
+
+
+def list_users(
+    cur: psycopg.Cursor,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+) -> List[Dict[str, Any]]:
+    """Return per-person metrics shaped like ``frontend/docs/data-schema.json``."""
+    return _cached(cur, "list_users", None, (start, end), lambda: _load_users(cur, start, end))
+
+
+def get_user(
+    cur: psycopg.Cursor,
+    person_id: str,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+) -> Optional[Dict[str, Any]]:
+    """Return metrics for a single person, or ``None`` when they have no data."""
+
+    def load() -> Optional[Dict[str, Any]]:
+        users = _load_users(cur, start, end, person_id=person_id)
+        return users[0] if users else None
+
+    return _cached(cur, "user", person_id, (start, end), load)
+
+
+def _load_users(
+    cur: psycopg.Cursor,
+    start: Optional[datetime],
+    end: Optional[datetime],
+    person_id: Optional[str] = None,
+) -> List[Dict[str, Any]]:
+    cur.execute(
+        """
+        SELECT
+            person_id,
+            MAX(bpm) AS high_bpm,
+            MIN(bpm) AS low_bpm,
+            AVG(bpm)::float AS avg_bpm,
+            AVG(confidence)::float AS avg_confidence,
+            COALESCE(STDDEV_SAMP(bpm), 0)::float AS bpm_stddev,
+            COUNT(*) AS sample_count,
+            MIN(date_time) AS window_start,
+            MAX(date_time) AS window_end,
+            MAX(ingested_at) AS last_updated
+        FROM filtered_data
+        WHERE (%(person_id)s::varchar IS NULL OR person_id = %(person_id)s)
+          AND (%(start)s::timestamp IS NULL OR date_time >= %(start)s)
+          AND (%(end)s::timestamp IS NULL OR date_time < %(end)s)
+        GROUP BY person_id
+        ORDER BY person_id
+        """,
+        {"person_id": person_id, "start": start, "end": end},
+    )
+
+    users: List[Dict[str, Any]] = []
+    for row in cur.fetchall():
+        users.append(
+            {
+                "id": _person_number(row["person_id"]),
+                "name": row["person_id"],
+                "high_bpm": row["high_bpm"],
+                "low_bpm": row["low_bpm"],
+                "avg_bpm": row["avg_bpm"],
+                "avg_confidence": (row["avg_confidence"] or 0.0) / MAX_CONFIDENCE,
+                "bpm_stddev": row["bpm_stddev"],
+                "sample_count": int(row["sample_count"]),
+                "window": {"start": row["window_start"], "end": row["window_end"]},
+                "last_updated": row["last_updated"],
+            }
+        )
+    logger.debug("Loaded metrics for %s users.", len(users))
+    return users
+
+
+def _person_number(person_id: str) -> int:
+    digits = person_id.lstrip("p")
+    return int(digits) if digits.isdigit() else 0
+
+
+def get_pipeline_health(cur: psycopg.Cursor, hours: int = 24) -> Dict[str, Any]:
+    """
+    Summarise recent raw_to_filtered runs from ``log_raw_to_filt``.
+
+    The status is ``"failing"`` when no batch completed within the window or
+    an error was logged after the last completed batch.
+    """
+    # Keyed on the newest log row: failing runs log errors without inserting
+    # rows, so filtered_data generations would not change.
+    return _cached(
+        cur,
+        "pipeline_health",
+        None,
+        (hours,),
+        lambda: _load_pipeline_health(cur, hours),
+        version=lambda: _latest_log_id(cur),
+    )
+
+
+def _load_pipeline_health(cur: psycopg.Cursor, hours: int) -> Dict[str, Any]:
+    since = datetime.now().astimezone() - timedelta(hours=hours)
+
+    cur.execute(
+        """
+        SELECT json_data ->> 'level' AS level, COUNT(*) AS cnt, MAX(ingested_at) AS last_at
+        FROM log_raw_to_filt
+        WHERE json_data ->> 'level' IN ('info', 'error')
+          AND ingested_at >= %s
+        GROUP BY json_data ->> 'level'
+        """,
+        (since,),
+    )
+    levels = {row["level"]: row for row in cur.fetchall()}
+
+    # Inlined as a literal so the predicate matches the partial index under generic plans.
+    cur.execute(
+        sql.SQL(
+            """
+            SELECT json_data, ingested_at
+            FROM log_raw_to_filt
+            WHERE json_data ->> 'message' = {message}
+            ORDER BY ingested_at DESC
+            LIMIT 1
+            """
+        ).format(message=sql.Literal(BATCH_COMPLETED_MESSAGE))
+    )
+    last_batch = cur.fetchone()
+
+    error_row = levels.get("error")
+    last_error_at = error_row["last_at"] if error_row else None
+    last_batch_at = last_batch["ingested_at"] if last_batch else None
+    batch_details = last_batch["json_data"] if last_batch else {}
+
+    failing = (
+        last_batch_at is None
+        or last_batch_at < since
+        or (last_error_at is not None and last_error_at > last_batch_at)
+    )
+
+    return {
+        "status": "failing" if failing else "passing",
+        "window_hours": hours,
+        "error_count": int(error_row["cnt"]) if error_row else 0,
+        "info_count": int(levels["info"]["cnt"]) if "info" in levels else 0,
+        "last_error_at": last_error_at,
+        "last_batch_at": last_batch_at,
+        "last_batch_inserted": batch_details.get("inserted_total"),
+        "last_batch_skipped": batch_details.get("skipped_total"),
+        "row_balance": batch_details.get("row_balance_after"),
+    }
+
+
+def _run_benchmark(dsn: str, iterations: int, person_id: str, days: int) -> Dict[str, Any]:
+    from psycopg.rows import dict_row
+
+    def percentile(samples: List[float], pct: float) -> float:
+        ordered = sorted(samples)
+        return ordered[min(int(len(ordered) * pct), len(ordered) - 1)]
+
+    with psycopg.connect(dsn) as conn, conn.cursor(row_factory=dict_row) as cur:
+        cur.execute(
+            "SELECT MAX(date_time) AS latest FROM filtered_data WHERE person_id = %s",
+            (person_id,),
+        )
+        row = cur.fetchone()
+        end = (row and row["latest"]) or datetime.now()
+        end = end + timedelta(seconds=1)
+        start = end - timedelta(days=days)
+
+        queries: Dict[str, Callable[[], Any]] = {
+            "person_series_minmax": lambda: get_person_series(cur, person_id, start, end),
+            "person_series_lttb": lambda: get_person_series(
+                cur, person_id, start, end, method="lttb"
+            ),
+            "list_users": lambda: list_users(cur),
+            "pipeline_health": lambda: get_pipeline_health(cur),
+        }
+
+        report: Dict[str, Any] = {}
+        for name, query in queries.items():
+            cold: List[float] = []
+            warm: List[float] = []
+            for _ in range(iterations):
+                RESULT_CACHE.clear()
+                began = time.perf_counter()
+                query()
+                cold.append((time.perf_counter() - began) * 1000)
+                began = time.perf_counter()
+                query()
+                warm.append((time.perf_counter() - began) * 1000)
+            report[name] = {
+                "cold_p50_ms": round(percentile(cold, 0.50), 3),
+                "cold_p95_ms": round(percentile(cold, 0.95), 3),
+                "warm_p50_ms": round(percentile(warm, 0.50), 3),
+                "warm_p95_ms": round(percentile(warm, 0.95), 3),
+            }
+            logger.info("Benchmark %s: %s", name, report[name])
+        return report
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+
+    from pipeline_common import APP_DSN
+
+    parser = argparse.ArgumentParser(description="Benchmark dashboard queries locally.")
+    parser.add_argument("--dsn", default=APP_DSN, help="Database connection string.")
+    parser.add_argument("--iterations", type=int, default=20, help="Runs per query.")
+    parser.add_argument("--person", default="p01", help="Person to query series for.")
+    parser.add_argument("--days", type=int, default=30, help="Series window length in days.")
+    parser.add_argument(
+        "--verbose",
+        "-v",
+        action="store_true",
+        help="Enable DEBUG level logging.",
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.DEBUG if args.verbose else logging.INFO,
+        format="%(asctime)s %(levelname)s %(name)s %(message)s",
+    )
+
+    try:
+        result = _run_benchmark(args.dsn, args.iterations, args.person, args.days)
+        print(json.dumps(result, indent=2, default=str))
+    except Exception:
+        logging.exception("Benchmark failed")
@@ -0,0 +1,486 @@
+from __future__ import annotations
+
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
+
+import psycopg
+from psycopg import errors, sql
+from psycopg.rows import dict_row
+
+from pipeline_common import (
+    APP_DSN,
+    MAX_RAW_ID,
+    ensure_pipeline_tables,
+    get_checkpoint,
+    log_event,
+    seed_checkpoint,
+)
+
+DEFAULT_RAW_RETENTION_DAYS = 30
+DEFAULT_LOG_RETENTION_DAYS = 14
+DEFAULT_CHUNK_SIZE = 5_000
+DEFAULT_PAUSE_SECONDS = 0.05
+DEFAULT_MAX_SECONDS = 240.0
+# Fail fast instead of queueing behind ingestion when a row or table lock is held.
+LOCK_TIMEOUT = "2s"
+STATEMENT_TIMEOUT = "30s"
+# Chunks that hit a lock or statement timeout are retried; give up on a table after this many in a row.
+MAX_CONSECUTIVE_CHUNK_FAILURES = 3
+# Compaction runs are logged apart from log_raw_to_filt so they never affect transfer health.
+COMPACTION_LOG_TABLE = "log_compaction"
+
+
+logger = logging.getLogger(__name__)
+
+def lambda_handler(event: Optional[Dict[str, Any]], context: Any) -> Dict[str, Any]:
+    """
+    AWS Lambda entry point. Compacts raw_data rows already moved to filtered_data and
+    rolls old log_raw_to_filt events up into daily summaries.
+
+    Recognised event keys: raw_retention_days, log_retention_days, chunk_size,
+    pause_seconds, max_seconds, archive (copy raw rows to raw_data_archive before
+    deleting), vacuum (run VACUUM ANALYZE afterwards).
+    """
+    event = event or {}
+    logger.info("lambda_compaction invocation started.")
+    logger.debug("Invocation payload: event=%s context=%s", event, context)
+
+    raw_retention_days = int(event.get("raw_retention_days", DEFAULT_RAW_RETENTION_DAYS))
+    log_retention_days = int(event.get("log_retention_days", DEFAULT_LOG_RETENTION_DAYS))
+    chunk_size = int(event.get("chunk_size", DEFAULT_CHUNK_SIZE))
+    pause_seconds = float(event.get("pause_seconds", DEFAULT_PAUSE_SECONDS))
+    max_seconds = float(event.get("max_seconds", DEFAULT_MAX_SECONDS))
+    archive = bool(event.get("archive", False))
+    vacuum = bool(event.get("vacuum", True))
+
+    now = datetime.now(timezone.utc)
+    deadline = time.monotonic() + max_seconds
+
+    summary: Dict[str, Any] = {
+        "raw_cutoff": (now - timedelta(days=raw_retention_days)).isoformat(),
+        "log_cutoff": (now - timedelta(days=log_retention_days)).isoformat(),
+        "checkpoint_raw_id": 0,
+        "archived": archive,
+        "raw": {},
+        "log": {},
+    }
+
+    try:
+        logger.info("Opening database connection.")
+        with psycopg.connect(APP_DSN, autocommit=True) as conn:
+            logger.info("Database connection established.")
+            with conn.cursor(row_factory=dict_row) as cur:
+                cur.execute(f"SET lock_timeout = '{LOCK_TIMEOUT}'")
+                cur.execute(f"SET statement_timeout = '{STATEMENT_TIMEOUT}'")
+                with conn.transaction():
+                    ensure_pipeline_tables(cur)
+                    _ensure_compaction_tables(cur)
+                    checkpoint = get_checkpoint(cur)
+                    if checkpoint is None:
+                        # Seed before the log rollup deletes the legacy batch events
+                        # that record how far the old transfer got.
+                        checkpoint = seed_checkpoint(cur)
+                logger.debug("Ensured required tables exist. checkpoint=%s", checkpoint)
+                summary["checkpoint_raw_id"] = checkpoint
+
+                raw_cutoff = now - timedelta(days=raw_retention_days)
+                log_cutoff = now - timedelta(days=log_retention_days)
+                raw_upper = min(_first_id_at_or_after(cur, "raw_data", raw_cutoff), checkpoint + 1)
+                log_upper = _first_id_at_or_after(cur, "log_raw_to_filt", log_cutoff)
+
+                raw_statement = _ARCHIVE_RAW_CHUNK if archive else _DELETE_RAW_CHUNK
+                summary["raw"] = _run_chunks(
+                    conn,
+                    cur,
+                    table_name="raw_data",
+                    statement=raw_statement,
+                    params={
+                        "upper": raw_upper,
+                        "cutoff": raw_cutoff,
+                        "chunk": chunk_size,
+                    },
+                    pause_seconds=pause_seconds,
+                    deadline=deadline,
+                    vacuum=vacuum,
+                )
+                summary["log"] = _run_chunks(
+                    conn,
+                    cur,
+                    table_name="log_raw_to_filt",
+                    statement=_ROLLUP_LOG_CHUNK,
+                    params={
+                        "upper": log_upper,
+                        "cutoff": log_cutoff,
+                        "chunk": chunk_size,
+                    },
+                    pause_seconds=pause_seconds,
+                    deadline=deadline,
+                    vacuum=vacuum,
+                )
+
+                with conn.transaction():
+                    log_event(
+                        cur,
+                        level="info",
+                        message="Compaction completed.",
+                        details={"raw": summary["raw"], "log": summary["log"]},
+                        table=COMPACTION_LOG_TABLE,
+                    )
+
+        logger.info(
+            "Compaction complete. raw_rows=%s log_rows=%s bytes_reclaimed=%s",
+            summary["raw"].get("rows"),
+            summary["log"].get("rows"),
+            summary["raw"].get("bytes_reclaimed", 0) + summary["log"].get("bytes_reclaimed", 0),
+        )
+        return summary
+
+    except Exception as exc:
+        logger.exception("lambda_compaction execution failed: %s", exc)
+        try:
+            with psycopg.connect(APP_DSN) as conn, conn.cursor() as cur:
+                _ensure_compaction_tables(cur)
+                log_event(
+                    cur,
+                    level="error",
+                    message="Unhandled exception in lambda_compaction.",
+                    details={"error": str(exc)},
+                    table=COMPACTION_LOG_TABLE,
+                )
+        except Exception:
+            # Suppress logging errors during exception handling.
+            pass
+        raise
+
+
+def _ensure_compaction_tables(cur: psycopg.Cursor) -> None:
+    logger.debug("Ensuring log_compaction table exists.")
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS log_compaction (
+            id BIGSERIAL PRIMARY KEY,
+            json_data JSONB NOT NULL,
+            ingested_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+        )
+        """
+    )
+    logger.debug("Ensuring raw_data_archive table exists.")
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS raw_data_archive (
+            id BIGINT PRIMARY KEY,
+            json_data JSONB NOT NULL,
+            ingested_at TIMESTAMPTZ NOT NULL,
+            archived_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+        )
+        """
+    )
+    logger.debug("Ensuring log_raw_to_filt_daily table exists.")
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS log_raw_to_filt_daily (
+            day DATE NOT NULL,
+            level TEXT NOT NULL,
+            message TEXT NOT NULL,
+            event_count BIGINT NOT NULL,
+            inserted_total BIGINT NOT NULL DEFAULT 0,
+            skipped_total BIGINT NOT NULL DEFAULT 0,
+            first_at TIMESTAMPTZ NOT NULL,
+            last_at TIMESTAMPTZ NOT NULL,
+            PRIMARY KEY (day, level, message)
+        )
+        """
+    )
+
+
+# Each statement removes one keyset chunk (after_id < id < upper, ascending) and reports
+# the rows removed, the last id seen, and their on-disk tuple size. SKIP LOCKED
+# leaves rows held by concurrent writers for a later run instead of waiting.
+_DELETE_RAW_CHUNK = """
+    WITH doomed AS (
+        SELECT id
+        FROM raw_data
+        WHERE id > %(after_id)s
+          AND id < %(upper)s
+          AND ingested_at < %(cutoff)s
+        ORDER BY id
+        LIMIT %(chunk)s
+        FOR UPDATE SKIP LOCKED
+    ),
+    removed AS (
+        DELETE FROM raw_data r
+        USING doomed d
+        WHERE r.id = d.id
+        RETURNING r.id, pg_column_size(r.*) AS tuple_bytes
+    )
+    SELECT COUNT(*) AS cnt, MAX(id) AS last_id, COALESCE(SUM(tuple_bytes), 0) AS bytes
+    FROM removed
+"""
+
+_ARCHIVE_RAW_CHUNK = """
+    WITH doomed AS (
+        SELECT id
+        FROM raw_data
+        WHERE id > %(after_id)s
+          AND id < %(upper)s
+          AND ingested_at < %(cutoff)s
+        ORDER BY id
+        LIMIT %(chunk)s
+        FOR UPDATE SKIP LOCKED
+    ),
+    removed AS (
+        DELETE FROM raw_data r
+        USING doomed d
+        WHERE r.id = d.id
+        RETURNING r.id, r.json_data, r.ingested_at, pg_column_size(r.*) AS tuple_bytes
+    ),
+    archived AS (
+        INSERT INTO raw_data_archive (id, json_data, ingested_at)
+        SELECT id, json_data, ingested_at
+        FROM removed
+        ON CONFLICT (id) DO NOTHING
+    )
+    SELECT COUNT(*) AS cnt, MAX(id) AS last_id, COALESCE(SUM(tuple_bytes), 0) AS bytes
+    FROM removed
+"""
+
+_ROLLUP_LOG_CHUNK = """
+    WITH doomed AS (
+        SELECT id
+        FROM log_raw_to_filt
+        WHERE id > %(after_id)s
+          AND id < %(upper)s
+          AND ingested_at < %(cutoff)s
+        ORDER BY id
+        LIMIT %(chunk)s
+        FOR UPDATE SKIP LOCKED
+    ),
+    removed AS (
+        DELETE FROM log_raw_to_filt l
+        USING doomed d
+        WHERE l.id = d.id
+        RETURNING l.id, l.json_data, l.ingested_at, pg_column_size(l.*) AS tuple_bytes
+    ),
+    rolled AS (
+        INSERT INTO log_raw_to_filt_daily AS daily (
+            day, level, message, event_count, inserted_total, skipped_total, first_at, last_at
+        )
+        SELECT
+            (ingested_at AT TIME ZONE 'UTC')::date,
+            COALESCE(json_data ->> 'level', 'unknown'),
+            COALESCE(json_data ->> 'message', ''),
+            COUNT(*),
+            COALESCE(SUM((json_data ->> 'inserted_total')::bigint), 0),
+            COALESCE(SUM((json_data ->> 'skipped_total')::bigint), 0),
+            MIN(ingested_at),
+            MAX(ingested_at)
+        FROM removed
+        GROUP BY 1, 2, 3
+        ON CONFLICT (day, level, message) DO UPDATE
+        SET event_count = daily.event_count + EXCLUDED.event_count,
+            inserted_total = daily.inserted_total + EXCLUDED.inserted_total,
+            skipped_total = daily.skipped_total + EXCLUDED.skipped_total,
+            first_at = LEAST(daily.first_at, EXCLUDED.first_at),
+            last_at = GREATEST(daily.last_at, EXCLUDED.last_at)
+    )
+    SELECT COUNT(*) AS cnt, MAX(id) AS last_id, COALESCE(SUM(tuple_bytes), 0) AS bytes
+    FROM removed
+"""
+
+
+def _first_id_at_or_after(cur: psycopg.Cursor, table_name: str, cutoff: datetime) -> int:
+    """
+    Return the id of the oldest row ingested at or after ``cutoff``.
+
+    Chunks stop below this id, so the final (empty) chunk does not walk the
+    primary key across the whole retention window. Rows ingested out of id order
+    are still filtered per row and are picked up by a later run. Uses the
+    ``ingested_at`` B-tree indexes created by ``migrations.py``.
+    """
+    cur.execute(
+        sql.SQL(
+            "SELECT id FROM {} WHERE ingested_at >= %s ORDER BY ingested_at LIMIT 1"
+        ).format(sql.Identifier(table_name)),
+        (cutoff,),
+    )
+    row = cur.fetchone()
+    upper = int(row["id"]) if row else MAX_RAW_ID
+    logger.debug("Compaction upper bound for %s is id %s", table_name, upper)
+    return upper
+
+
+def _run_chunks(
+    conn: psycopg.Connection,
+    cur: psycopg.Cursor,
+    *,
+    table_name: str,
+    statement: str,
+    params: Dict[str, Any],
+    pause_seconds: float,
+    deadline: float,
+    vacuum: bool,
+) -> Dict[str, Any]:
+    """Run ``statement`` one short transaction per chunk until nothing is left or time runs out."""
+    relation_bytes_before = _get_relation_size(cur, table_name)
+    latencies_ms: List[float] = []
+    total_rows = 0
+    total_bytes = 0
+    after_id = 0
+    timed_out = False
+    failed_chunks = 0
+    consecutive_failures = 0
+
+    while True:
+        if time.monotonic() >= deadline:
+            logger.info("Time budget exhausted while compacting %s.", table_name)
+            timed_out = True
+            break
+
+        began = time.perf_counter()
+        try:
+            with conn.transaction():
+                cur.execute(statement, {**params, "after_id": after_id})
+                row = cur.fetchone()
+        except (errors.LockNotAvailable, errors.QueryCanceled) as exc:
+            # The chunk rolled back; back off and retry it instead of aborting the run.
+            latencies_ms.append((time.perf_counter() - began) * 1000)
+            failed_chunks += 1
+            consecutive_failures += 1
+            logger.warning(
+                "Chunk on %s after id %s failed (%s); attempt %s of %s.",
+                table_name,
+                after_id,
+                exc,
+                consecutive_failures,
+                MAX_CONSECUTIVE_CHUNK_FAILURES,
+            )
+            if consecutive_failures >= MAX_CONSECUTIVE_CHUNK_FAILURES:
+                break
+            time.sleep(max(pause_seconds, 0.5) * consecutive_failures)
+            continue
+        latencies_ms.append((time.perf_counter() - began) * 1000)
+        consecutive_failures = 0
+
+        removed = int(row["cnt"]) if row and row.get("cnt") is not None else 0
+        if removed == 0:
+            break
+
+        total_rows += removed
+        total_bytes += int(row["bytes"] or 0)
+        after_id = int(row["last_id"])
+        logger.debug(
+            "Compacted %s rows from %s up to id %s in %.1f ms.",
+            removed,
+            table_name,
+            after_id,
+            latencies_ms[-1],
+        )
+
+        if pause_seconds > 0:
+            time.sleep(pause_seconds)
+
+    vacuumed = False
+    if vacuum and total_rows and not timed_out:
+        vacuumed = _vacuum_within_budget(cur, table_name, deadline)
+
+    stats = {
+        "rows": total_rows,
+        "chunks": len(latencies_ms),
+        "bytes_reclaimed": total_bytes,
+        "relation_bytes_before": relation_bytes_before,
+        "relation_bytes_after": _get_relation_size(cur, table_name),
+        "last_id": after_id,
+        "timed_out": timed_out,
+        "failed_chunks": failed_chunks,
+        "vacuumed": vacuumed,
+        **_latency_stats(latencies_ms),
+    }
+    logger.info("Compaction of %s finished: %s", table_name, stats)
+    return stats
+
+
+def _vacuum_within_budget(cur: psycopg.Cursor, table_name: str, deadline: float) -> bool:
+    """VACUUM ANALYZE ``table_name`` with a statement timeout capped at the remaining budget."""
+    remaining_ms = int((deadline - time.monotonic()) * 1000)
+    if remaining_ms < 1_000:
+        logger.info("Skipping VACUUM on %s; %s ms left in budget.", table_name, remaining_ms)
+        return False
+
+    # Plain VACUUM does not block concurrent inserts; it makes the freed space reusable.
+    logger.info("Running VACUUM ANALYZE on %s (timeout %s ms).", table_name, remaining_ms)
+    try:
+        cur.execute(f"SET statement_timeout = {remaining_ms}")
+        cur.execute(sql.SQL("VACUUM (ANALYZE) {}").format(sql.Identifier(table_name)))
+        return True
+    except errors.QueryCanceled:
+        logger.warning("VACUUM on %s did not finish within the budget.", table_name)
+        return False
+    finally:
+        cur.execute(f"SET statement_timeout = '{STATEMENT_TIMEOUT}'")
+
+
+def _get_relation_size(cur: psycopg.Cursor, table_name: str) -> int:
+    cur.execute("SELECT pg_total_relation_size(%s::regclass) AS size", (table_name,))
+    row = cur.fetchone()
+    return int(row["size"]) if row and row.get("size") is not None else 0
+
+
+def _latency_stats(latencies_ms: List[float]) -> Dict[str, float]:
+    if not latencies_ms:
+        return {"chunk_p50_ms": 0.0, "chunk_p95_ms": 0.0, "chunk_max_ms": 0.0}
+    ordered = sorted(latencies_ms)
+    return {
+        "chunk_p50_ms": round(ordered[len(ordered) // 2], 3),
+        "chunk_p95_ms": round(ordered[min(int(len(ordered) * 0.95), len(ordered) - 1)], 3),
+        "chunk_max_ms": round(ordered[-1], 3),
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description="Run lambda_compaction locally.")
+    parser.add_argument("--raw-retention-days", type=int, default=DEFAULT_RAW_RETENTION_DAYS)
+    parser.add_argument("--log-retention-days", type=int, default=DEFAULT_LOG_RETENTION_DAYS)
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument("--pause-seconds", type=float, default=DEFAULT_PAUSE_SECONDS)
+    parser.add_argument("--max-seconds", type=float, default=DEFAULT_MAX_SECONDS)
+    parser.add_argument(
+        "--archive",
+        action="store_true",
+        help="Copy raw_data rows to raw_data_archive instead of only deleting them.",
+    )
+    parser.add_argument("--no-vacuum", action="store_true", help="Skip VACUUM ANALYZE.")
+    parser.add_argument(
+        "--verbose",
+        "-v",
+        action="store_true",
+        help="Enable DEBUG level logging.",
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.DEBUG if args.verbose else logging.INFO,
+        format="%(asctime)s %(levelname)s %(name)s %(message)s",
+    )
+
+    logger.info("Running locally... verbose=%s", args.verbose)
+    try:
+        result = lambda_handler(
+            {
+                "raw_retention_days": args.raw_retention_days,
+                "log_retention_days": args.log_retention_days,
+                "chunk_size": args.chunk_size,
+                "pause_seconds": args.pause_seconds,
+                "max_seconds": args.max_seconds,
+                "archive": args.archive,
+                "vacuum": not args.no_vacuum,
+            },
+            None,
+        )
+        print(json.dumps(result, indent=2, default=str))
+    except Exception:
+        logging.exception("Local run failed")
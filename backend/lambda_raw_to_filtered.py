@@ -1,15 +1,22 @@
 from __future__ import annotations
 
 import logging
-from typing import Any, Dict, Optional
+from typing import Any, Dict, List, Optional, Set, Union
 
 import psycopg
 from psycopg import sql
 from psycopg.rows import dict_row
-from psycopg.types.json import Json
 
-APP_DSN = (
-    "will be changed in future"
+from pipeline_common import (
+    APP_DSN,
+    BATCH_COMPLETED_MESSAGE,
+    bump_generations,
+    ensure_pipeline_tables,
+    get_checkpoint,
+    get_visible_horizon,
+    log_event,
+    seed_checkpoint,
+    set_checkpoint,
 )
 
 
@@ -30,11 +37,12 @@ def lambda_handler(event: Optional[Dict[str, Any]], context: Any) -> Dict[str, A
         "moved_rows": 0,
         "skipped_rows": 0,
         "duplicate_rows": 0,
-        "offset": 0,
+        "checkpoint_raw_id": 0,
         "logged_errors": 0,
         "iterations": 0,
         "total_attempted": 0,
         "total_valid_rows": 0,
+        "updated_persons": [],
     }
 
     try:
@@ -42,46 +50,40 @@ def lambda_handler(event: Optional[Dict[str, Any]], context: Any) -> Dict[str, A
         with psycopg.connect(APP_DSN) as conn:
             logger.info("Database connection established.")
             with conn.cursor(row_factory=dict_row) as cur:
-                _ensure_tables(cur)
+                ensure_pipeline_tables(cur)
                 logger.debug("Ensured required tables exist.")
 
+                checkpoint_start = get_checkpoint(cur)
+                if checkpoint_start is None:
+                    checkpoint_start = seed_checkpoint(cur)
+                # Computed before this transaction writes anything; rows at or past
+                # the bound may have lower-id neighbours still in flight.
+                horizon = get_visible_horizon(cur, checkpoint_start)
+
                 raw_count = _get_table_count(cur, "raw_data")
                 filtered_count = _get_table_count(cur, "filtered_data")
-                row_balance = raw_count - filtered_count
+                # Rows past the checkpoint still need to be moved; counting them
+                # instead of raw - filtered keeps the balance correct once old
+                # raw_data rows are compacted away.
+                row_balance = _get_pending_count(cur, checkpoint_start, horizon)
 
                 summary.update(
                     {
                         "raw_count": raw_count,
                         "filtered_count": filtered_count,
                         "row_balance": row_balance,
+                        "checkpoint_raw_id": checkpoint_start,
                     }
                 )
 
                 logger.info(
-                    "Row counts retrieved: raw=%s filtered=%s balance=%s",
+                    "Row counts retrieved: raw=%s filtered=%s balance=%s checkpoint=%s",
                     raw_count,
                     filtered_count,
                     row_balance,
+                    checkpoint_start,
                 )
 
-                if row_balance < 0:
-                    logger.error(
-                        "Row balance is negative. Skipping transfer. raw=%s filtered=%s",
-                        raw_count,
-                        filtered_count,
-                    )
-                    _log_event(
-                        cur,
-                        level="error",
-                        message="Filtered data row count exceeds raw data row count.",
-                        details={
-                            "raw_count": raw_count,
-                            "filtered_count": filtered_count,
-                            "row_balance": row_balance,
-                        },
-                    )
-                    return summary
-
                 initial_row_balance = row_balance
                 summary["initial_row_balance"] = initial_row_balance
                 total_attempted = 0
@@ -90,8 +92,9 @@ def lambda_handler(event: Optional[Dict[str, Any]], context: Any) -> Dict[str, A
                 total_skipped = 0
                 total_duplicates = 0
                 total_logged_errors = 0
+                updated_persons: Set[str] = set()
                 iterations = 0
-                source_offset_start = filtered_count
+                checkpoint = checkpoint_start
 
                 while row_balance > 0:
                     batch_size = _determine_batch_size(row_balance)
@@ -106,15 +109,14 @@ def lambda_handler(event: Optional[Dict[str, Any]], context: Any) -> Dict[str, A
                         logger.info("Batch size returned 0; exiting loop.")
                         break
 
-                    stage_stats = _stage_and_insert_batch(
-                        cur, batch_size, source_offset_start + total_attempted
-                    )
+                    stage_stats = _stage_and_insert_batch(cur, batch_size, checkpoint, horizon)
                     attempted = stage_stats["total_considered"]
                     valid_rows = stage_stats["valid_rows"]
                     inserted = stage_stats["inserted"]
                     skipped = stage_stats["skipped"]
                     duplicates = stage_stats["duplicates"]
                     logged_errors = stage_stats["logged_errors"]
+                    updated_persons.update(stage_stats["updated_persons"])
 
                     iterations += 1
                     total_attempted += attempted
@@ -126,16 +128,20 @@ def lambda_handler(event: Optional[Dict[str, Any]], context: Any) -> Dict[str, A
 
                     if attempted == 0 and inserted == 0:
                         logger.info(
-                            "Iteration %s yielded no new rows (offset %s); stopping.",
+                            "Iteration %s yielded no new rows (checkpoint %s); stopping.",
                             iterations,
-                            stage_stats["offset"],
+                            checkpoint,
                         )
                         break
 
+                    checkpoint = stage_stats["last_raw_id"]
+                    set_checkpoint(cur, checkpoint)
+                    bump_generations(cur, stage_stats["updated_persons"])
+
                     filtered_count += inserted
                     summary["filtered_count"] = filtered_count
 
-                    row_balance = raw_count - filtered_count
+                    row_balance -= attempted
                     summary["row_balance_after"] = row_balance
 
                     logger.info(
@@ -157,16 +163,17 @@ def lambda_handler(event: Optional[Dict[str, Any]], context: Any) -> Dict[str, A
                 summary["skipped_rows"] = total_skipped
                 summary["duplicate_rows"] = total_duplicates
                 summary["logged_errors"] = total_logged_errors
-                summary["offset"] = source_offset_start + total_attempted
+                summary["checkpoint_raw_id"] = checkpoint
                 summary["iterations"] = iterations
                 summary["total_attempted"] = total_attempted
                 summary["total_valid_rows"] = total_valid
                 summary["row_balance_after"] = row_balance
+                summary["updated_persons"] = sorted(updated_persons)
 
-                _log_event(
+                log_event(
                     cur,
                     level="info",
-                    message="Batch move completed.",
+                    message=BATCH_COMPLETED_MESSAGE,
                     details={
                         "iterations": iterations,
                         "requested_batch_last": summary["target_batch"],
@@ -175,14 +182,14 @@ def lambda_handler(event: Optional[Dict[str, Any]], context: Any) -> Dict[str, A
                         "inserted_total": total_inserted,
                         "skipped_total": total_skipped,
                         "duplicates_total": total_duplicates,
-                        "source_offset_start": source_offset_start,
-                        "source_offset_end": summary["offset"],
+                        "checkpoint_start": checkpoint_start,
+                        "checkpoint_end": checkpoint,
                         "logged_errors_total": total_logged_errors,
                         "row_balance_before": initial_row_balance,
                         "row_balance_after": row_balance,
+                        "updated_persons": summary["updated_persons"],
                     },
                 )
-
         return summary
 
     except Exception as exc:
@@ -190,7 +197,7 @@ def lambda_handler(event: Optional[Dict[str, Any]], context: Any) -> Dict[str, A
         logging.exception("lambda_raw_to_filtered execution failed.")
         try:
             with psycopg.connect(APP_DSN) as conn, conn.cursor() as cur:
-                _log_event(
+                log_event(
                     cur,
                     level="error",
                     message="Unhandled exception in lambda_raw_to_filtered.",
@@ -202,32 +209,6 @@ def lambda_handler(event: Optional[Dict[str, Any]], context: Any) -> Dict[str, A
         raise
 
 
-def _ensure_tables(cur: psycopg.Cursor) -> None:
-    logger.debug("Ensuring filtered_data table exists.")
-    cur.execute(
-        """
-        CREATE TABLE IF NOT EXISTS filtered_data (
-            person_id  VARCHAR(5) NOT NULL,
-            date_time  TIMESTAMP NOT NULL,
-            bpm        INTEGER NOT NULL,
-            confidence INTEGER NOT NULL,
-            ingested_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
-            PRIMARY KEY (person_id, date_time)
-        )
-        """
-    )
-    logger.debug("Ensuring log_raw_to_filt table exists.")
-    cur.execute(
-        """
-        CREATE TABLE IF NOT EXISTS log_raw_to_filt (
-            id BIGSERIAL PRIMARY KEY,
-            json_data JSONB NOT NULL,
-            ingested_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
-        )
-        """
-    )
-
-
 # def _get_table_count(cur: psycopg.Cursor, table_name: str) -> int:
 #     query = sql.SQL("SELECT COUNT(*) FROM {}").format(sql.Identifier(table_name))
 #     cur.execute(query)
@@ -241,6 +222,15 @@ def _get_table_count(cur: psycopg.Cursor, table_name: str) -> int:
     logger.debug("Count query for %s returned %s", table_name, row)
     return int(row["cnt"]) if row and row.get("cnt") is not None else 0
 
+def _get_pending_count(cur: psycopg.Cursor, last_raw_id: int, horizon: int) -> int:
+    cur.execute(
+        "SELECT COUNT(*) AS cnt FROM raw_data WHERE id > %s AND id < %s",
+        (last_raw_id, horizon),
+    )
+    row = cur.fetchone()
+    return int(row["cnt"]) if row and row.get("cnt") is not None else 0
+
+
 def _determine_batch_size(row_balance: int) -> int:
     if row_balance <= 0:
         return 0
@@ -255,16 +245,14 @@ def _determine_batch_size(row_balance: int) -> int:
 
 
 def _stage_and_insert_batch(
-    cur: psycopg.Cursor, batch_size: int, offset: int
-) -> Dict[str, int]:
+    cur: psycopg.Cursor, batch_size: int, after_id: int, before_id: int
+) -> Dict[str, Union[int, List[str]]]:
     logger.debug(
-        "Starting SQL-based staging for up to %s rows with offset %s.",
+        "Starting SQL-based staging for up to %s rows after raw_data.id %s.",
         batch_size,
-        offset,
+        after_id,
     )
 
-    offset = max(offset, 0)
-
     cur.execute("DROP TABLE IF EXISTS filtered_stage")
     cur.execute(
         """
@@ -282,8 +270,8 @@ def _stage_and_insert_batch(
         WITH candidate AS (
             SELECT id, json_data
             FROM raw_data
+            WHERE id > %s AND id < %s
             ORDER BY id
-            OFFSET %s
             LIMIT %s
         ),
         normalized AS (
@@ -373,6 +361,7 @@ def _stage_and_insert_batch(
             (SELECT COUNT(*) FROM validated) AS total_considered,
             (SELECT COUNT(*) FROM validated WHERE is_valid) AS valid_count,
             (SELECT COUNT(*) FROM staged) AS staged_count,
+            (SELECT MAX(id) FROM validated) AS last_raw_id,
             COALESCE(
                 (
                     SELECT json_agg(
@@ -388,14 +377,14 @@ def _stage_and_insert_batch(
                 '[]'::json
             ) AS invalid_rows
         """,
-        (offset, batch_size),
+        (after_id, before_id, batch_size),
     )
 
     stats = cur.fetchone()
     if not stats:
         logger.debug(
-            "SQL staging returned no rows for offset %s and batch size %s.",
-            offset,
+            "SQL staging returned no rows after raw_data.id %s and batch size %s.",
+            after_id,
             batch_size,
         )
         cur.execute("DROP TABLE IF EXISTS filtered_stage")
@@ -405,8 +394,9 @@ def _stage_and_insert_batch(
             "inserted": 0,
             "duplicates": 0,
             "skipped": 0,
-            "offset": offset,
+            "last_raw_id": after_id,
             "logged_errors": 0,
+            "updated_persons": [],
         }
 
     total_considered = int(stats.get("total_considered") or 0)
@@ -414,19 +404,20 @@ def _stage_and_insert_batch(
     staged_rows = int(stats.get("staged_count") or 0)
     invalid_rows = stats.get("invalid_rows") or []
     logged_errors = len(invalid_rows)
+    last_raw_id = int(stats.get("last_raw_id") or after_id)
 
     logger.debug(
-        "SQL staging complete. total=%s valid=%s staged=%s invalid=%s offset=%s",
+        "SQL staging complete. total=%s valid=%s staged=%s invalid=%s last_raw_id=%s",
         total_considered,
         valid_rows,
         staged_rows,
         len(invalid_rows),
-        offset,
+        last_raw_id,
     )
 
     if invalid_rows:
         for invalid in invalid_rows:
-            _log_event(
+            log_event(
                 cur,
                 level="error",
                 message=invalid.get("reason", "Invalid json_data in raw_data."),
@@ -435,17 +426,26 @@ def _stage_and_insert_batch(
 
     inserted = 0
     duplicates = 0
+    updated_persons: List[str] = []
     if staged_rows:
         logger.debug("Inserting staged rows into filtered_data.")
         cur.execute(
             """
-            INSERT INTO filtered_data (person_id, date_time, bpm, confidence)
-            SELECT person_id, date_time, bpm, confidence
-            FROM filtered_stage
-            ON CONFLICT (person_id, date_time) DO NOTHING
+            WITH inserted AS (
+                INSERT INTO filtered_data (person_id, date_time, bpm, confidence)
+                SELECT person_id, date_time, bpm, confidence
+                FROM filtered_stage
+                ON CONFLICT (person_id, date_time) DO NOTHING
+                RETURNING person_id
+            )
+            SELECT person_id, COUNT(*) AS cnt
+            FROM inserted
+            GROUP BY person_id
             """
         )
-        inserted = cur.rowcount or 0
+        per_person = cur.fetchall()
+        inserted = sum(int(row["cnt"]) for row in per_person)
+        updated_persons = [row["person_id"] for row in per_person]
         duplicates = max(staged_rows - inserted, 0)
         logger.debug(
             "Filtered insert complete. inserted=%s duplicates=%s", inserted, duplicates
@@ -461,32 +461,12 @@ def _stage_and_insert_batch(
         "inserted": inserted,
         "duplicates": duplicates,
         "skipped": total_considered - valid_rows,
-        "offset": offset,
+        "last_raw_id": last_raw_id,
         "logged_errors": logged_errors,
+        "updated_persons": updated_persons,
     }
 
 
-def _log_event(
-    cur: psycopg.Cursor,
-    *,
-    level: str,
-    message: str,
-    details: Optional[Dict[str, Any]] = None,
-) -> None:
-    payload: Dict[str, Any] = {"level": level, "message": message}
-    if details:
-        payload.update(details)
-
-    cur.execute(
-        """
-        INSERT INTO log_raw_to_filt (json_data)
-        VALUES (%s)
-        """,
-        (Json(payload),),
-    )
-    logger.debug("Logged event to log_raw_to_filt: level=%s message=%s", level, message)
-
-
 if __name__ == "__main__":
     import argparse
     import json
@@ -0,0 +1,119 @@
+from __future__ import annotations
+
+import logging
+from typing import List, Tuple
+
+import psycopg
+from psycopg import sql
+from psycopg.rows import dict_row
+
+from pipeline_common import BATCH_COMPLETED_MESSAGE, ensure_pipeline_tables, seed_checkpoint
+
+logger = logging.getLogger(__name__)
+
+# (index name, table, definition after "ON <table>").
+QUERY_INDEXES: List[Tuple[str, str, sql.Composable]] = [
+    # Lets series and per-user aggregates run as index-only scans. It repeats
+    # the primary key columns, so every filtered_data insert writes one more B-tree.
+    (
+        "filtered_data_person_time_cov_idx",
+        "filtered_data",
+        sql.SQL("(person_id, date_time) INCLUDE (bpm, confidence, ingested_at)"),
+    ),
+    (
+        "log_raw_to_filt_level_time_idx",
+        "log_raw_to_filt",
+        sql.SQL("((json_data ->> 'level'), ingested_at)"),
+    ),
+    (
+        "log_raw_to_filt_batch_done_idx",
+        "log_raw_to_filt",
+        sql.SQL("(ingested_at) WHERE json_data ->> 'message' = {message}").format(
+            message=sql.Literal(BATCH_COMPLETED_MESSAGE)
+        ),
+    ),
+    # Let compaction find its retention cutoff id with one index probe. The
+    # raw_data one adds a B-tree write to every ingested row.
+    (
+        "raw_data_ingested_at_idx",
+        "raw_data",
+        sql.SQL("(ingested_at)"),
+    ),
+    (
+        "log_raw_to_filt_ingested_at_idx",
+        "log_raw_to_filt",
+        sql.SQL("(ingested_at)"),
+    ),
+]
+
+
+def create_query_indexes(conn: psycopg.Connection) -> None:
+    """
+    Build the dashboard and compaction indexes with CREATE INDEX CONCURRENTLY.
+
+    Run once per database, outside the transfer path; concurrent builds cannot
+    run in a transaction block, so the connection is switched to autocommit.
+    """
+    conn.autocommit = True
+    with conn.cursor(row_factory=dict_row) as cur:
+        for name, table, definition in QUERY_INDEXES:
+            # A failed concurrent build leaves an INVALID index that IF NOT EXISTS would keep.
+            cur.execute(
+                """
+                SELECT i.indisvalid
+                FROM pg_index i
+                JOIN pg_class c ON c.oid = i.indexrelid
+                WHERE c.relname = %s
+                """,
+                (name,),
+            )
+            row = cur.fetchone()
+            if row and not row["indisvalid"]:
+                logger.warning("Dropping invalid index %s before rebuilding.", name)
+                cur.execute(
+                    sql.SQL("DROP INDEX CONCURRENTLY IF EXISTS {}").format(sql.Identifier(name))
+                )
+            elif row:
+                logger.info("Index %s already exists.", name)
+                continue
+
+            logger.info("Creating index %s on %s concurrently.", name, table)
+            cur.execute(
+                sql.SQL("CREATE INDEX CONCURRENTLY IF NOT EXISTS {} ON {} {}").format(
+                    sql.Identifier(name), sql.Identifier(table), definition
+                )
+            )
+
+
+def seed_transfer_checkpoint(conn: psycopg.Connection) -> int:
+    """Create the shared tables and seed the transfer checkpoint from the legacy offset log."""
+    with conn.transaction(), conn.cursor(row_factory=dict_row) as cur:
+        ensure_pipeline_tables(cur)
+        return seed_checkpoint(cur)
+
+
+def run_migrations(dsn: str) -> None:
+    with psycopg.connect(dsn, autocommit=True) as conn:
+        seed_transfer_checkpoint(conn)
+        create_query_indexes(conn)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from pipeline_common import APP_DSN
+
+    parser = argparse.ArgumentParser(description="Apply one-time database migrations.")
+    parser.add_argument("--dsn", default=APP_DSN, help="Database connection string.")
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s %(levelname)s %(name)s %(message)s",
+    )
+
+    try:
+        run_migrations(args.dsn)
+    except Exception:
+        logging.exception("Migration failed")
+        raise
@@ -0,0 +1,211 @@
+from __future__ import annotations
+
+import logging
+from typing import Any, Dict, Iterable, Optional
+
+import psycopg
+from psycopg import sql
+from psycopg.types.json import Json
+
+APP_DSN = (
+    "will be changed in future"
+)
+
+TRANSFER_LOG_TABLE = "log_raw_to_filt"
+BATCH_COMPLETED_MESSAGE = "Batch move completed."
+# Upper id bound used when no raw_data row is newer than the visibility horizon.
+MAX_RAW_ID = 2**63 - 1
+# raw_data rows younger than this are never passed by the transfer checkpoint.
+RAW_SETTLE_SECONDS = 120
+
+
+logger = logging.getLogger(__name__)
+
+def ensure_pipeline_tables(cur: psycopg.Cursor) -> None:
+    """Create the tables shared by the transfer, compaction and dashboard code."""
+    logger.debug("Ensuring filtered_data table exists.")
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS filtered_data (
+            person_id  VARCHAR(5) NOT NULL,
+            date_time  TIMESTAMP NOT NULL,
+            bpm        INTEGER NOT NULL,
+            confidence INTEGER NOT NULL,
+            ingested_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+            PRIMARY KEY (person_id, date_time)
+        )
+        """
+    )
+    logger.debug("Ensuring raw_to_filt_checkpoint table exists.")
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS raw_to_filt_checkpoint (
+            id SMALLINT PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+            last_raw_id BIGINT NOT NULL DEFAULT 0,
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+        )
+        """
+    )
+    logger.debug("Ensuring filtered_data_generation table exists.")
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS filtered_data_generation (
+            person_id  VARCHAR(5) PRIMARY KEY,
+            generation BIGINT NOT NULL DEFAULT 0,
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+        )
+        """
+    )
+    logger.debug("Ensuring log_raw_to_filt table exists.")
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS log_raw_to_filt (
+            id BIGSERIAL PRIMARY KEY,
+            json_data JSONB NOT NULL,
+            ingested_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+        )
+        """
+    )
+
+
+def get_checkpoint(cur: psycopg.Cursor) -> Optional[int]:
+    """Return the last raw_data.id the transfer has processed, or ``None`` if never seeded."""
+    cur.execute("SELECT last_raw_id FROM raw_to_filt_checkpoint WHERE id = 1")
+    row = cur.fetchone()
+    logger.debug("Checkpoint query returned %s", row)
+    return int(row["last_raw_id"]) if row else None
+
+
+def seed_checkpoint(cur: psycopg.Cursor) -> int:
+    """
+    One-time migration from the OFFSET-based transfer to the id checkpoint.
+
+    The old transfer logged how many raw_data rows (in id order) it had consumed
+    as ``source_offset_end``; the checkpoint starts at the id of the last of
+    those rows so they are neither re-moved nor logged as invalid a second time.
+    Does nothing if a checkpoint already exists.
+    """
+    cur.execute(
+        sql.SQL(
+            """
+            WITH legacy AS (
+                SELECT (json_data ->> 'source_offset_end')::bigint AS consumed
+                FROM log_raw_to_filt
+                WHERE json_data ->> 'message' = {message}
+                  AND json_data ? 'source_offset_end'
+                ORDER BY id DESC
+                LIMIT 1
+            )
+            INSERT INTO raw_to_filt_checkpoint (id, last_raw_id, updated_at)
+            SELECT 1, CASE
+                WHEN EXISTS (SELECT 1 FROM legacy WHERE consumed > 0) THEN COALESCE(
+                    (
+                        SELECT id
+                        FROM raw_data
+                        ORDER BY id
+                        OFFSET (SELECT consumed - 1 FROM legacy)
+                        LIMIT 1
+                    ),
+                    (SELECT MAX(id) FROM raw_data),
+                    0
+                )
+                ELSE 0
+            END, NOW()
+            ON CONFLICT (id) DO NOTHING
+            """
+        ).format(message=sql.Literal(BATCH_COMPLETED_MESSAGE))
+    )
+    checkpoint = get_checkpoint(cur) or 0
+    logger.info("Transfer checkpoint seeded at raw_data.id=%s", checkpoint)
+    return checkpoint
+
+
+def set_checkpoint(cur: psycopg.Cursor, last_raw_id: int) -> None:
+    cur.execute(
+        """
+        INSERT INTO raw_to_filt_checkpoint (id, last_raw_id, updated_at)
+        VALUES (1, %s, NOW())
+        ON CONFLICT (id) DO UPDATE
+        SET last_raw_id = GREATEST(raw_to_filt_checkpoint.last_raw_id, EXCLUDED.last_raw_id),
+            updated_at = EXCLUDED.updated_at
+        """,
+        (last_raw_id,),
+    )
+    logger.debug("Checkpoint advanced to raw_data.id=%s", last_raw_id)
+
+
+def get_visible_horizon(
+    cur: psycopg.Cursor, after_id: int, settle_seconds: int = RAW_SETTLE_SECONDS
+) -> int:
+    """
+    Return an exclusive raw_data.id bound for advancing the transfer checkpoint.
+
+    ``raw_data.id`` comes from a sequence, so a lower id can still be held by an
+    uncommitted transaction after higher ids are visible. Nothing in the catalog
+    maps in-flight transactions to the ids they hold: ``nextval`` runs before an
+    inserting transaction gets its xid, so xid order does not bound id order.
+    This is therefore a heuristic with two guards. The bound stops at the first
+    row that was written at or after the snapshot's xmin, and at the first row
+    whose transaction started less than ``settle_seconds`` ago. A row can still
+    be passed if it is held by a writer that stays uncommitted past both guards.
+    Call this before the current transaction writes anything, or its own xid
+    becomes the horizon.
+    """
+    cur.execute(
+        """
+        SELECT MIN(id) AS bound
+        FROM raw_data
+        WHERE id > %s
+          AND (
+              age(xmin) <= age(pg_snapshot_xmin(pg_current_snapshot())::xid)
+              OR ingested_at > clock_timestamp() - make_interval(secs => %s)
+          )
+        """,
+        (after_id, settle_seconds),
+    )
+    row = cur.fetchone()
+    logger.debug("Visibility horizon after raw_data.id=%s is %s", after_id, row)
+    return int(row["bound"]) if row and row.get("bound") is not None else MAX_RAW_ID
+
+
+def bump_generations(cur: psycopg.Cursor, person_ids: Iterable[str]) -> None:
+    """Bump per-person generations so dashboard caches drop results for these persons."""
+    ordered = sorted(set(person_ids))
+    if not ordered:
+        return
+    cur.execute(
+        """
+        INSERT INTO filtered_data_generation (person_id, generation, updated_at)
+        SELECT person_id, 1, NOW()
+        FROM unnest(%s::varchar[]) AS person_id
+        ON CONFLICT (person_id) DO UPDATE
+        SET generation = filtered_data_generation.generation + 1,
+            updated_at = EXCLUDED.updated_at
+        """,
+        (ordered,),
+    )
+    logger.debug("Bumped filtered_data generations for %s", ordered)
+
+
+def log_event(
+    cur: psycopg.Cursor,
+    *,
+    level: str,
+    message: str,
+    details: Optional[Dict[str, Any]] = None,
+    table: str = TRANSFER_LOG_TABLE,
+) -> None:
+    payload: Dict[str, Any] = {"level": level, "message": message}
+    if details:
+        payload.update(details)
+
+    cur.execute(
+        sql.SQL(
+            """
+            INSERT INTO {} (json_data)
+            VALUES (%s)
+            """
+        ).format(sql.Identifier(table)),
+        (Json(payload),),
+    )
+    logger.debug("Logged event to %s: level=%s message=%s", table, level, message)
@@ -0,0 +1,96 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+pytest.importorskip("psycopg")
+
+import dashboard_queries
+from dashboard_queries import TTLCache, _lttb
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(dashboard_queries.time, "monotonic", fake)
+    return fake
+
+
+def test_cache_hit_within_ttl(clock):
+    cache = TTLCache(maxsize=4, ttl_seconds=10)
+    cache.set(("a", "p01", ()), 1, "value")
+
+    clock.now += 9
+    assert cache.get(("a", "p01", ()), 1) == (True, "value")
+
+
+def test_cache_expires_after_ttl(clock):
+    cache = TTLCache(maxsize=4, ttl_seconds=10)
+    cache.set(("a", "p01", ()), 1, "value")
+
+    clock.now += 10
+    assert cache.get(("a", "p01", ()), 1) == (False, None)
+    assert len(cache) == 0
+
+
+def test_cache_misses_on_new_generation(clock):
+    cache = TTLCache(maxsize=4, ttl_seconds=10)
+    cache.set(("a", "p01", ()), 1, "value")
+
+    assert cache.get(("a", "p01", ()), 2) == (False, None)
+    # The stale entry is dropped, so the old generation no longer hits either.
+    assert cache.get(("a", "p01", ()), 1) == (False, None)
+
+
+def test_cache_evicts_least_recently_used(clock):
+    cache = TTLCache(maxsize=2, ttl_seconds=10)
+    cache.set(("a", None, ()), 0, 1)
+    cache.set(("b", None, ()), 0, 2)
+    cache.get(("a", None, ()), 0)
+    cache.set(("c", None, ()), 0, 3)
+
+    assert cache.get(("b", None, ()), 0) == (False, None)
+    assert cache.get(("a", None, ()), 0) == (True, 1)
+    assert cache.get(("c", None, ()), 0) == (True, 3)
+
+
+def _points(count):
+    origin = datetime(2020, 1, 1)
+    return [
+        {"date_time": origin + timedelta(seconds=i), "bpm": 60 + (i * 7) % 41}
+        for i in range(count)
+    ]
+
+
+def test_lttb_keeps_endpoints_and_order():
+    points = _points(5_000)
+    sampled = _lttb(points, 100)
+
+    assert len(sampled) == 100
+    assert sampled[0] is points[0]
+    assert sampled[-1] is points[-1]
+    times = [point["date_time"] for point in sampled]
+    assert times == sorted(times)
+    assert len(set(times)) == len(times)
+
+
+def test_lttb_picks_spike():
+    points = _points(1_000)
+    for point in points:
+        point["bpm"] = 60
+    points[500]["bpm"] = 180
+
+    assert points[500] in _lttb(points, 10)
+
+
+@pytest.mark.parametrize("threshold", [2, 50, 60])
+def test_lttb_returns_input_when_not_reducing(threshold):
+    points = _points(50)
+    assert _lttb(points, threshold) == points
@@ -0,0 +1,33 @@
+import pytest
+
+pytest.importorskip("psycopg")
+
+from lambda_compaction import _latency_stats
+
+
+def test_latency_stats_empty():
+    assert _latency_stats([]) == {"chunk_p50_ms": 0.0, "chunk_p95_ms": 0.0, "chunk_max_ms": 0.0}
+
+
+def test_latency_stats_single_chunk():
+    assert _latency_stats([12.3456]) == {
+        "chunk_p50_ms": 12.346,
+        "chunk_p95_ms": 12.346,
+        "chunk_max_ms": 12.346,
+    }
+
+
+def test_latency_stats_percentiles_ignore_input_order():
+    latencies = [float(value) for value in range(100, 0, -1)]
+
+    stats = _latency_stats(latencies)
+
+    assert stats == {"chunk_p50_ms": 51.0, "chunk_p95_ms": 96.0, "chunk_max_ms": 100.0}
+
+
+def test_latency_stats_p95_stays_in_range_for_small_samples():
+    stats = _latency_stats([5.0, 1.0, 3.0])
+
+    assert stats["chunk_p50_ms"] == 3.0
+    assert stats["chunk_p95_ms"] == 5.0
+    assert stats["chunk_max_ms"] == 5.0
@@ -2,16 +2,17 @@
 
 from __future__ import annotations
 
-import json
 import logging
 import time
 from collections import deque
 from pathlib import Path
-from typing import Deque, Dict, Iterator, Tuple
+from typing import Deque, Dict, Iterator, Optional, Tuple
 
 import psycopg
 from psycopg.types.json import Json
 
+from heart_rate_index import RecordIndex, StaleIndexError
+
 APP_DSN = "dbname=appdb user=appuser password=secret host=localhost port=5432"
 BASE_DIR = Path(__file__).resolve().parent / "pmdata"
 PEOPLE = [f"p{str(i).zfill(2)}" for i in range(1, 17)]
@@ -32,13 +33,19 @@ def ensure_raw_data_table(conn: psycopg.Connection) -> None:
         )
 
 
-def load_records_for_person(person: str) -> Iterator[dict]:
-    """Yield JSON payloads for a single person."""
-    file_path = BASE_DIR / person / "fitbit" / "heart_rate.json"
-    with open(file_path, "r", encoding="utf-8") as handle:
-        records = json.load(handle)
+def heart_rate_path(person: str) -> Path:
+    """Return the heart_rate.json path for a single person."""
+    return BASE_DIR / person / "fitbit" / "heart_rate.json"
+
+
+def load_records_for_person(
+    person: str, start: int = 0, index: Optional[RecordIndex] = None
+) -> Iterator[dict]:
+    """Yield JSON payloads for a single person, beginning at record ``start``."""
+    if index is None:
+        index = RecordIndex.load_or_build(heart_rate_path(person))
 
-    for record in records:
+    for record in index.iter_records(start):
         yield {
             "person_id": person,
             "dateTime": record.get("dateTime"),
@@ -47,33 +54,18 @@ def load_records_for_person(person: str) -> Iterator[dict]:
 
 
 def build_stream_queue() -> Deque[Tuple[str, Iterator[dict]]]:
-    """Prepare a round-robin queue of iterators, skipping missing or invalid files."""
+    """Prepare a round-robin queue of iterators, skipping missing files."""
     queue: Deque[Tuple[str, Iterator[dict]]] = deque()
 
     for person in PEOPLE:
-        file_path = BASE_DIR / person / "fitbit" / "heart_rate.json"
+        file_path = heart_rate_path(person)
         if not file_path.exists():
             logging.warning("Skipping %s - missing file at %s", person, file_path)
             continue
 
-        try:
-            iterator = load_records_for_person(person)
-            # Prime the generator by peeking to catch JSON issues early.
-            peek = next(iterator)
-        except StopIteration:
-            logging.warning("Skipping %s - no data in %s", person, file_path)
-            continue
-        except json.JSONDecodeError as exc:
-            logging.error("Skipping %s - invalid JSON (%s)", person, exc)
-            continue
-
-        # Rebuild iterator with the peeked record included.
-        def prepend_first(first_item: dict, rest_iter: Iterator[dict]) -> Iterator[dict]:
-            yield first_item
-            for item in rest_iter:
-                yield item
-
-        queue.append((person, prepend_first(peek, iterator)))
+        # The index is built lazily on the first next() so streaming starts
+        # without waiting for every person's file to be scanned.
+        queue.append((person, load_records_for_person(person)))
 
     return queue
 
@@ -99,6 +91,20 @@ def stream_raw_data() -> None:
                 except StopIteration:
                     logging.info("Finished streaming %s", person)
                     continue
+                except ValueError as exc:
+                    # Raised by the lazy index build before any of this person's
+                    # rows are inserted; malformed single records are skipped
+                    # inside iter_records instead.
+                    logging.error("Skipping %s - invalid JSON (%s)", person, exc)
+                    continue
+                except StaleIndexError as exc:
+                    logging.error(
+                        "Stopping %s after %d entries - %s",
+                        person,
+                        counters.get(person, 0),
+                        exc,
+                    )
+                    continue
 
                 counters[person] = counters.get(person, 0) + 1
                 logging.info(
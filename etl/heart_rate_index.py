@@ -0,0 +1,232 @@
+"""Byte-offset index for top-level JSON arrays such as heart_rate.json."""
+
+from __future__ import annotations
+
+import json
+import logging
+import mmap
+import os
+import re
+from array import array
+from pathlib import Path
+from typing import Iterator, List, Optional, Tuple
+
+INDEX_SUFFIX = ".idx"
+INDEX_MAGIC = 0x31584449524D5048  # b"HPMRIDX1" read as little-endian uint64
+HEADER_SIZE = 4  # magic, source size, source mtime_ns, record count
+
+# Strings are matched whole so brackets and commas inside them are ignored.
+_TOKEN_RE = re.compile(rb'"(?:[^"\\]|\\.)*"|[\[\]{},]', re.DOTALL)
+_WHITESPACE = b" \t\r\n"
+_TRAILING_RE = re.compile(rb"[ \t\r\n]*\Z")
+
+
+class StaleIndexError(RuntimeError):
+    """Raised when a file changes on disk while its records are being read."""
+
+
+def index_path_for(file_path: Path) -> Path:
+    """Return the sidecar index path for a JSON file."""
+    return file_path.with_name(file_path.name + INDEX_SUFFIX)
+
+
+def scan_offsets(buffer: mmap.mmap) -> array:
+    """
+    Scan a top-level JSON array once and return flat (start, end) byte offsets.
+
+    The scan walks every structural token in Python, so building an index costs
+    several times a plain ``json.load`` of the same file. It is paid once per
+    file version; later loads only read the sidecar.
+    """
+    offsets = array("Q")
+    size = len(buffer)
+
+    pos = 0
+    while pos < size and buffer[pos] in _WHITESPACE:
+        pos += 1
+    if pos >= size or buffer[pos] != ord("["):
+        raise ValueError("Expected a top-level JSON array")
+
+    depth = 0
+    start = -1
+    for match in _TOKEN_RE.finditer(buffer, pos):
+        token = match.group()
+        if token[0] == ord('"'):
+            continue
+
+        if token in (b"[", b"{"):
+            depth += 1
+            if depth == 1:
+                start = match.end()
+            continue
+
+        if token == b"," and depth != 1:
+            continue
+
+        if token in (b"]", b"}"):
+            depth -= 1
+            if depth < 0:
+                raise ValueError(f"Unbalanced bracket at byte {match.start()}")
+            if depth > 0 or token == b"}":
+                continue
+
+        # A comma at depth 1 or the closing bracket of the top-level array.
+        end = match.start()
+        while start < end and buffer[start] in _WHITESPACE:
+            start += 1
+        while end > start and buffer[end - 1] in _WHITESPACE:
+            end -= 1
+        if start < end:
+            offsets.append(start)
+            offsets.append(end)
+        elif token == b"," or offsets:
+            # Only "[]" may close without an element; "[1,]" is a trailing comma.
+            raise ValueError(f"Empty array element at byte {match.start()}")
+
+        if depth == 0:
+            if not _TRAILING_RE.match(buffer, match.end()):
+                raise ValueError(f"Unexpected data after top-level array at byte {match.end()}")
+            return offsets
+        start = match.end()
+
+    raise ValueError("Unterminated top-level JSON array")
+
+
+class RecordIndex:
+    """Per-record byte offsets for a JSON array file, persisted as an array('Q') sidecar.
+
+    The sidecar stores a small header (magic, source size, source mtime_ns, record
+    count) followed by interleaved start/end offsets. It is rebuilt whenever the
+    source file's size or mtime no longer match the header, and reading records
+    raises StaleIndexError if the file changes after the index was loaded.
+    """
+
+    def __init__(self, file_path: Path, offsets: array, size: int, mtime_ns: int) -> None:
+        self.file_path = file_path
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self._offsets = offsets
+
+    def __len__(self) -> int:
+        return len(self._offsets) // 2
+
+    @classmethod
+    def load_or_build(cls, file_path: Path) -> "RecordIndex":
+        """Load a fresh sidecar index for ``file_path`` or rebuild it."""
+        stat = file_path.stat()
+        sidecar = index_path_for(file_path)
+
+        offsets = cls._read_sidecar(sidecar, stat.st_size, stat.st_mtime_ns)
+        if offsets is None:
+            logging.info("Indexing %s", file_path)
+            offsets = cls._build_offsets(file_path, stat.st_size)
+            cls._write_sidecar(sidecar, stat.st_size, stat.st_mtime_ns, offsets)
+
+        return cls(file_path, offsets, stat.st_size, stat.st_mtime_ns)
+
+    @staticmethod
+    def _build_offsets(file_path: Path, size: int) -> array:
+        if size == 0:
+            raise ValueError(f"{file_path} is empty")
+        with open(file_path, "rb") as handle, mmap.mmap(
+            handle.fileno(), 0, access=mmap.ACCESS_READ
+        ) as buffer:
+            return scan_offsets(buffer)
+
+    @staticmethod
+    def _read_sidecar(sidecar: Path, size: int, mtime_ns: int) -> Optional[array]:
+        try:
+            with open(sidecar, "rb") as handle:
+                raw = handle.read()
+        except FileNotFoundError:
+            return None
+
+        data = array("Q")
+        if len(raw) % data.itemsize:
+            logging.warning("Ignoring truncated index %s", sidecar)
+            return None
+        data.frombytes(raw)
+
+        if len(data) < HEADER_SIZE or data[0] != INDEX_MAGIC:
+            logging.warning("Ignoring unrecognised index %s", sidecar)
+            return None
+        if data[1] != size or data[2] != mtime_ns:
+            logging.info("Index %s is stale; rebuilding", sidecar)
+            return None
+        if len(data) != HEADER_SIZE + 2 * data[3]:
+            logging.warning("Ignoring inconsistent index %s", sidecar)
+            return None
+
+        return data[HEADER_SIZE:]
+
+    @staticmethod
+    def _write_sidecar(sidecar: Path, size: int, mtime_ns: int, offsets: array) -> None:
+        data = array("Q", (INDEX_MAGIC, size, mtime_ns, len(offsets) // 2))
+        data.extend(offsets)
+
+        tmp_path = sidecar.with_name(sidecar.name + ".tmp")
+        try:
+            with open(tmp_path, "wb") as handle:
+                data.tofile(handle)
+            os.replace(tmp_path, sidecar)
+        except OSError as exc:
+            # A read-only data directory should not stop streaming.
+            logging.warning("Could not write index %s (%s)", sidecar, exc)
+
+    def span(self, position: int) -> Tuple[int, int]:
+        """Return the (start, end) byte range of record ``position``."""
+        if not 0 <= position < len(self):
+            raise IndexError(f"record {position} out of range")
+        return self._offsets[2 * position], self._offsets[2 * position + 1]
+
+    def _check_unchanged(self, fileno: int) -> None:
+        stat = os.fstat(fileno)
+        if stat.st_size != self.size or stat.st_mtime_ns != self.mtime_ns:
+            raise StaleIndexError(f"{self.file_path} changed on disk after it was indexed")
+
+    def iter_records(self, start: int = 0, stop: Optional[int] = None) -> Iterator[dict]:
+        """
+        Yield decoded records ``start`` to ``stop`` by seeking directly to each one.
+
+        A record that fails to decode is logged with its position and skipped.
+        The file is re-checked against the index before every record, since the
+        streamer may hold this iterator open for hours.
+        """
+        count = len(self)
+        stop = count if stop is None else min(stop, count)
+        if start >= stop:
+            return
+
+        with open(self.file_path, "rb") as handle:
+            self._check_unchanged(handle.fileno())
+            with mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                offsets = self._offsets
+                for position in range(max(start, 0), stop):
+                    self._check_unchanged(handle.fileno())
+                    begin = offsets[2 * position]
+                    end = offsets[2 * position + 1]
+                    try:
+                        record = json.loads(buffer[begin:end])
+                    except json.JSONDecodeError as exc:
+                        logging.warning(
+                            "Skipping record %d in %s - invalid JSON (%s)",
+                            position,
+                            self.file_path,
+                            exc,
+                        )
+                        continue
+                    yield record
+
+    def partition(self, workers: int) -> List[Tuple[int, int]]:
+        """Split the records into ``workers`` contiguous (start, stop) ranges."""
+        if workers < 1:
+            raise ValueError("workers must be at least 1")
+        count = len(self)
+        step, extra = divmod(count, workers)
+        ranges: List[Tuple[int, int]] = []
+        start = 0
+        for worker in range(workers):
+            stop = start + step + (1 if worker < extra else 0)
+            ranges.append((start, stop))
+            start = stop
+        return ranges
@@ -1,10 +1,11 @@
-import json
 import sys
 from pathlib import Path
 
 import psycopg
 from psycopg.types.json import Json
 
+from heart_rate_index import RecordIndex
+
 APP_DSN = "dbname=appdb user=appuser password=secret host=localhost port=5432"
 
 BASE_DIR = Path(__file__).resolve().parent / "pmdata"
@@ -31,19 +32,22 @@ with psycopg.connect(APP_DSN) as conn, conn.cursor() as cur:
 
         print(f"\n Loading {person} from {file_path}...")
 
-        with open(file_path, "r", encoding="utf-8") as f:
-            raw_records = json.load(f)
+        try:
+            index = RecordIndex.load_or_build(file_path)
+        except ValueError as exc:
+            print(f"Invalid JSON in {file_path}: {exc}")
+            continue
 
-        normalized_records = [
+        normalized_records = (
             {
                 "person_id": person,
                 "dateTime": record.get("dateTime"),
                 "value": record.get("value", {}),
             }
-            for record in raw_records
-        ]
+            for record in index.iter_records()
+        )
 
-        total = len(normalized_records)
+        total = len(index)
         print(f"   {total:,} rows to insert")
 
         cur.execute(
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# The etl scripts import each other as top-level modules.
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
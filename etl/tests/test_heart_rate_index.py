@@ -0,0 +1,153 @@
+import json
+import mmap
+import os
+
+import pytest
+
+from heart_rate_index import INDEX_MAGIC, RecordIndex, StaleIndexError, index_path_for, scan_offsets
+
+
+def _scan(tmp_path, text):
+    path = tmp_path / "data.json"
+    path.write_bytes(text.encode("utf-8"))
+    with open(path, "rb") as handle, mmap.mmap(
+        handle.fileno(), 0, access=mmap.ACCESS_READ
+    ) as buffer:
+        offsets = scan_offsets(buffer)
+    data = path.read_bytes()
+    return [
+        json.loads(data[offsets[i] : offsets[i + 1]]) for i in range(0, len(offsets), 2)
+    ]
+
+
+def _write(path, records):
+    path.write_text(json.dumps(records, indent=2), encoding="utf-8")
+
+
+@pytest.mark.parametrize(
+    "text, expected",
+    [
+        ("[]", []),
+        ("  [ ]\n", []),
+        ("[1, 2 ,\n3]", [1, 2, 3]),
+        ('[{"a": [1, {"b": 2}]}, []]', [{"a": [1, {"b": 2}]}, []]),
+        ('["x, ] } [ {", "q\\"],["]', ["x, ] } [ {", 'q"],[']),
+        ('[{"dateTime": "a\\\\", "value": {}}]\n', [{"dateTime": "a\\", "value": {}}]),
+    ],
+)
+def test_scan_offsets_valid(tmp_path, text, expected):
+    assert _scan(tmp_path, text) == expected
+
+
+@pytest.mark.parametrize(
+    "text",
+    ["{}", "[1,", "[1,]", "[1, 2 , ]", "[1,,2]", "[,]", "[1] junk", "[1]]"],
+)
+def test_scan_offsets_rejects_invalid(tmp_path, text):
+    with pytest.raises(ValueError):
+        _scan(tmp_path, text)
+
+
+def test_empty_file_is_rejected(tmp_path):
+    path = tmp_path / "heart_rate.json"
+    path.write_bytes(b"")
+    with pytest.raises(ValueError):
+        RecordIndex.load_or_build(path)
+
+
+def test_iter_records_from_offset(tmp_path):
+    path = tmp_path / "heart_rate.json"
+    records = [{"dateTime": str(i), "value": {"bpm": 60 + i, "confidence": 1}} for i in range(10)]
+    _write(path, records)
+
+    index = RecordIndex.load_or_build(path)
+    assert len(index) == 10
+    assert list(index.iter_records()) == records
+    assert list(index.iter_records(7)) == records[7:]
+    assert list(index.iter_records(2, 4)) == records[2:4]
+    assert list(index.iter_records(12)) == []
+
+
+def test_iter_records_skips_malformed_record(tmp_path, caplog):
+    path = tmp_path / "heart_rate.json"
+    path.write_text('[{"a": 1}, {"a": tru}, {"a": 3}]', encoding="utf-8")
+
+    assert list(RecordIndex.load_or_build(path).iter_records()) == [{"a": 1}, {"a": 3}]
+    assert "record 1" in caplog.text
+
+
+def test_sidecar_is_reused_when_fresh(tmp_path, monkeypatch):
+    path = tmp_path / "heart_rate.json"
+    _write(path, [1, 2, 3])
+    RecordIndex.load_or_build(path)
+    assert index_path_for(path).exists()
+
+    def fail(*args):
+        raise AssertionError("index should not be rebuilt")
+
+    monkeypatch.setattr(RecordIndex, "_build_offsets", staticmethod(fail))
+    assert list(RecordIndex.load_or_build(path).iter_records()) == [1, 2, 3]
+
+
+def test_sidecar_rebuilt_when_size_changes(tmp_path):
+    path = tmp_path / "heart_rate.json"
+    _write(path, [1, 2, 3])
+    RecordIndex.load_or_build(path)
+
+    _write(path, [10, 20, 30, 40])
+    assert list(RecordIndex.load_or_build(path).iter_records()) == [10, 20, 30, 40]
+
+
+def test_sidecar_rebuilt_when_only_mtime_changes(tmp_path):
+    path = tmp_path / "heart_rate.json"
+    path.write_text("[1, 2]", encoding="utf-8")
+    RecordIndex.load_or_build(path)
+
+    # Same size, different layout and mtime.
+    path.write_text("[12 ,3]", encoding="utf-8")
+    stat = path.stat()
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    assert list(RecordIndex.load_or_build(path).iter_records()) == [12, 3]
+
+
+@pytest.mark.parametrize("payload", [b"", b"\x00" * 7, b"\x00" * 40])
+def test_unusable_sidecar_is_ignored(tmp_path, payload):
+    path = tmp_path / "heart_rate.json"
+    _write(path, [1, 2])
+    index_path_for(path).write_bytes(payload)
+
+    assert list(RecordIndex.load_or_build(path).iter_records()) == [1, 2]
+    assert index_path_for(path).read_bytes()[:8] == INDEX_MAGIC.to_bytes(8, "little")
+
+
+def test_iter_records_detects_file_change(tmp_path):
+    path = tmp_path / "heart_rate.json"
+    _write(path, [1, 2, 3])
+    index = RecordIndex.load_or_build(path)
+
+    iterator = index.iter_records()
+    assert next(iterator) == 1
+    _write(path, [1, 2, 3, 4, 5])
+    with pytest.raises(StaleIndexError):
+        next(iterator)
+
+
+@pytest.mark.parametrize(
+    "count, workers, expected",
+    [
+        (10, 3, [(0, 4), (4, 7), (7, 10)]),
+        (2, 4, [(0, 1), (1, 2), (2, 2), (2, 2)]),
+        (0, 2, [(0, 0), (0, 0)]),
+    ],
+)
+def test_partition(tmp_path, count, workers, expected):
+    path = tmp_path / "heart_rate.json"
+    _write(path, list(range(count)))
+    assert RecordIndex.load_or_build(path).partition(workers) == expected
+
+
+def test_partition_requires_a_worker(tmp_path):
+    path = tmp_path / "heart_rate.json"
+    _write(path, [1])
+    with pytest.raises(ValueError):
+        RecordIndex.load_or_build(path).partition(0)